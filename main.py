@@ -8,15 +8,21 @@
 #  - https://api.aliyun.com/#/?product=Ecs
 
 import argparse
+import concurrent.futures
+import datetime
+import hashlib
 import json
 import logging
 import os
+import random
 import shutil
 import sys
 import tempfile
-from urllib.request import urlopen
+import time
 
 import git
+import requests
+from urllib3.util.retry import Retry
 
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.acs_exception.exceptions import ClientException
@@ -26,10 +32,52 @@ from aliyunsdkecs.request.v20140526.DescribeImagesRequest import DescribeImagesR
 from aliyunsdkecs.request.v20140526.ModifyImageSharePermissionRequest import ModifyImageSharePermissionRequest
 from aliyunsdkecs.request.v20140526.TagResourcesRequest import TagResourcesRequest
 
+# the rhcos.json blobs and the growing state file get parsed and serialized
+# constantly; orjson chews through them several times faster than the stdlib
+# json module, but don't make it a hard requirement. Both loads variants
+# accept bytes directly, so API responses skip an explicit utf-8 decode pass
+try:
+    import orjson
+    json_loads = orjson.loads
+    def json_dumps(data):
+        return orjson.dumps(data).decode("utf-8")
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
 
 OPENSHIFT_INSTALL_GIT = "https://github.com/openshift/installer"
 REDIRECTOR_URL = "https://rhcos-redirector.apps.art.xq1c.p1.openshiftapps.com/art/storage/releases/"
 
+# where results that survive between runs get cached
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rhcos-aliyun-pruner')
+
+# cap on how many Aliyun API calls to have in flight at once; the ECS API
+# rate-limits per account, and past a point more workers just means more
+# throttling errors, not more throughput
+MAX_ALIYUN_CONCURRENCY = 8
+
+# how many redirector fetches to have in flight at once
+HTTP_WORKERS = 16
+
+# API error codes worth retrying (prefix match) and how often to try; see
+# run_cmd()
+RETRYABLE_ERROR_CODES = ('Throttling', 'RequestLimitExceeded', 'ServiceUnavailable', 'InternalError')
+MAX_API_RETRIES = 5
+
+# when True, run_cmd() only reports what it would have done; set from
+# --dry-run in main()
+DRY_RUN = False
+
+# all the redirector fetches hit the same host, so share a pooled session and
+# let keep-alive amortize the TCP+TLS setup across them; retry transient
+# failures with a short backoff instead of dying mid-run. The pool is sized
+# to the worker count so no fetch has to wait on (or discard) a connection
+SESSION = requests.Session()
+SESSION.mount('https://', requests.adapters.HTTPAdapter(
+    pool_connections=1, pool_maxsize=HTTP_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.2)))
+
 # build out a dict where the first Aliyun artifact appeared to speed up the
 # interation through all the builds of a release.
 FIRSTRELEASE = {}
@@ -38,14 +86,76 @@ FIRSTRELEASE['ppc64le'] = 0
 FIRSTRELEASE['s390x'] = 0
 FIRSTRELEASE['x86_64'] = {'4.10': '410842021120118210', '4.11': '411842022020718390'}
 
-# Creates an Aliyun client for a region
+# translation table for turning a build ID (i.e. 410.84.202112011821-0) into
+# a comparable int; a single translate() pass beats chained replace() calls
+BUILDID_TRANS = str.maketrans('', '', '.-')
+
+# cache of AcsClient objects keyed off region_id; see create_client()
+CLIENT_CACHE = {}
+
+# the credentials never change for the life of the script, so resolve them
+# once instead of letting every new AcsClient walk the SDK's credential chain
+CREDENTIALS = {}
+
+# Creates (or reuses) an Aliyun client for a region
 #
 # Takes a region_id str as argument
 #
 # Returns an AcsClient object
 def create_client(region_id):
-    client = AcsClient(region_id=region_id)
-    return client
+    # constructing an AcsClient per API call throws away the underlying HTTP
+    # session, forcing a fresh TCP+TLS handshake every time; keep one client
+    # per region for the life of the script so connections are reused
+    if region_id not in CLIENT_CACHE:
+        if not CREDENTIALS:
+            CREDENTIALS['ak'] = os.environ['ALIYUN_ACCESS_KEY_ID']
+            CREDENTIALS['secret'] = os.environ['ALIYUN_ACCESS_KEY_SECRET']
+        CLIENT_CACHE[region_id] = AcsClient(ak=CREDENTIALS['ak'],
+                                            secret=CREDENTIALS['secret'],
+                                            region_id=region_id)
+    return CLIENT_CACHE[region_id]
+
+# Fetch a JSON doc from a URL, caching it on disk so repeated runs skip the
+# network entirely
+#
+# Takes a url str; optionally a daily boolean for docs that change over time,
+# which date-stamps the cache entry so it gets refetched once a day
+#
+# Returns the parsed JSON doc
+def cached_get_json(url, daily=False):
+    slug = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    if daily:
+        slug = "%s-%s" % (datetime.date.today().isoformat(), slug)
+    cache_path = os.path.join(CACHE_DIR, slug + '.json')
+    # just try the open; checking os.path.exists first is an extra stat and
+    # racy against a concurrent run
+    try:
+        with open(cache_path, 'r') as f:
+            logging.debug("Using cached copy of %s", url)
+            return json_loads(f.read())
+    except FileNotFoundError:
+        pass
+
+    doc = SESSION.get(url, timeout=30).json()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # write to a temp file and rename so a crash can't leave a half-written
+    # cache entry behind
+    with open(cache_path + '.tmp', 'w') as f:
+        f.write(json_dumps(doc))
+    os.replace(cache_path + '.tmp', cache_path)
+    return doc
+
+
+# Atomically write the bootimage state data out to disk
+#
+# Takes the file path str and the data dict as arguments
+def write_state_file(file_path, data):
+    # write to a temp file and rename so a crash mid-write can't leave a
+    # truncated state file behind for the next run to choke on
+    with open(file_path + '.tmp', 'w') as f:
+        f.write(json_dumps(data))
+    os.replace(file_path + '.tmp', file_path)
+
 
 # Utility function to get a list of images that are not tagged with "bootimage"
 #
@@ -55,22 +165,52 @@ def create_client(region_id):
 def get_images_not_tagged(bootimages):
     nottagged = {}
 
+    # DescribeImages accepts a JSON array of up to 100 image IDs per call, so
+    # bucket the images by region and describe them in batches instead of one
+    # request per image; the per-region batches then fan out over the thread
+    # pool
+    byregion = {}
     for bootimage in bootimages:
-        if bootimage not in nottagged:
-            nottagged[bootimage] = []
+        nottagged.setdefault(bootimage, [])
         logging.info(f"Searching for untagged images in build {bootimage}")
         for region in bootimages[bootimage]:
-            imageid = bootimages[bootimage][region]['image']
-            logging.debug(f"Getting image info for {imageid} in {region}")
-            response = get_image_info(region, imageid)
+            byregion.setdefault(region, []).append((bootimage, bootimages[bootimage][region]['image']))
+
+    def check_region(region, entries):
+        # the same image can be referenced by more than one build, so map each
+        # image id back to every build that owns it
+        owners = {}
+        for buildid, imageid in entries:
+            owners.setdefault(imageid, []).append(buildid)
+        untagged = []
+        # one request object per region; only the ImageId parameter changes
+        # between chunks. DescribeImages pages at 10 results by default, so
+        # raise PageSize to the batch size or most of the batch never comes
+        # back
+        describe_req = DescribeImagesRequest()
+        describe_req.set_protocol_type('https')
+        describe_req.set_PageSize(100)
+        # owners already holds each unique image id exactly once, so chunking
+        # its keys dedupes images shared between builds before any API call;
+        # the per-build fan-out happens from the lookup below instead
+        imageids = list(owners)
+        for start in range(0, len(imageids), 100):
+            chunk = imageids[start:start + 100]
+            logging.debug("Getting image info for %d images in %s", len(chunk), region)
+            response = get_image_info(region, json.dumps(chunk), describe_req=describe_req)
             for image in response['Images']['Image']:
-                tagfound = False
-                for tag in image['Tags']['Tag']:
-                    if tag['TagKey'] == 'bootimage' and \
-                      (tag['TagValue'] == 'true' or tag['TagValue'] == 'false'):
-                        break
+                tagfound = any(tag['TagKey'] == 'bootimage' and tag['TagValue'] in ('true', 'false')
+                               for tag in image['Tags']['Tag'])
                 if tagfound is False:
-                    nottagged[bootimage].append({'region_id': region, 'image_id': image['ImageId']})
+                    for buildid in owners[image['ImageId']]:
+                        untagged.append((buildid, {'region_id': region, 'image_id': image['ImageId']}))
+        return untagged
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_ALIYUN_CONCURRENCY) as executor:
+        futures = [executor.submit(check_region, region, entries) for region, entries in byregion.items()]
+        for future in concurrent.futures.as_completed(futures):
+            for buildid, entry in future.result():
+                nottagged[buildid].append(entry)
     return nottagged
 
 
@@ -83,26 +223,45 @@ def get_images_not_tagged(bootimages):
 def parse_release(release, json_file):
     releases = {}
     logging.debug(f"Getting all builds for RHCOS {release}")
-    jsonurl = urlopen("%srhcos-%s/builds.json" % (REDIRECTOR_URL, release))
-    buildjson = json.loads(jsonurl.read())
-
+    # builds.json grows as new builds land, so only trust a cached copy for a
+    # day; the per-build meta.json files never change once published and can
+    # be cached forever
+    buildjson = cached_get_json("%srhcos-%s/builds.json" % (REDIRECTOR_URL, release), daily=True)
+
+    # collect the eligible builds first, then fetch all of their meta.json
+    # files in parallel; the fetches are independent GETs against the same
+    # host so they pool nicely
+    candidates = []
+    # the comparison threshold is constant per arch, so compute it once out
+    # here instead of re-parsing FIRSTRELEASE for every build (this also
+    # drops a stray [0] index that compared against just the first digit of
+    # the threshold)
+    thresholds = {}
     for build in (buildjson['builds']):
         buildid = build['id']
         if buildid in json_file:
-            logging.debug(f"Build ID: {buildid} found in file")
+            logging.debug("Build ID: %s found in file", buildid)
             continue
         arch = build['arches'][0]
-        buildid_int = int((buildid.replace('.','')).replace('-',''))
+        if arch not in thresholds:
+            thresholds[arch] = int(FIRSTRELEASE[arch][release])
         # Look only for builds after the aliyun inclusion
         # TODO: we can improve it keeping a record for the build we already checked
-        if buildid_int >= int(FIRSTRELEASE[arch][release][0]):
+        if int(buildid.translate(BUILDID_TRANS)) >= thresholds[arch]:
             metajsonURL = ("%srhcos-%s/%s/%s/meta.json" % (REDIRECTOR_URL, release, buildid ,arch))
-            logging.debug(f"Checking {buildid} for Aliyun uploads")
-            jsonurl = urlopen(metajsonURL)
-            metajson = json.loads(jsonurl.read())
+            candidates.append((buildid, metajsonURL))
+
+    def fetch_meta(buildid, metajsonURL):
+        logging.debug("Checking %s for Aliyun uploads", buildid)
+        return buildid, cached_get_json(metajsonURL)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HTTP_WORKERS) as executor:
+        futures = [executor.submit(fetch_meta, buildid, url) for buildid, url in candidates]
+        for future in concurrent.futures.as_completed(futures):
+            buildid, metajson = future.result()
             if 'aliyun' in metajson:
                 # Create the same output we have for bootimages
-                logging.debug(f"Recording Aliyun images for {buildid}")
+                logging.debug("Recording Aliyun images for %s", buildid)
                 releases[buildid] = {}
                 for entry in metajson['aliyun']:
                     releases[buildid][entry['name']] = {'image':entry['id']}
@@ -137,7 +296,7 @@ def tag_image(region_id, image_id, tag_key=None, tag_value=None):
     tag_resp = run_cmd([client, tag_request])
     if tag_resp == 'dry_run':
         return json.dumps('{}')
-    return json.loads(tag_resp.decode("utf-8"))
+    return json_loads(tag_resp)
 
 # Tag an image with `key:value`; defaults to `bootimage:false` and
 # return a json file with region_id and image_id
@@ -152,43 +311,53 @@ def tag_image_and_save_to_file(image_list, file_path, tag_key=None, tag_value=No
     if tag_value is None:
         tag_value = "false"
 
+    # the tag calls are independent API round-trips, so fan them out over the
+    # thread pool; an image is only recorded in the state data once its tag
+    # call has actually come back
+    def tag_one(buildid, region_id, image_id):
+        tag_image(region_id, image_id, tag_key, tag_value)
+        return buildid, region_id, image_id
+
     new_data = {}
-    for buildid in image_list:
-        for region in image_list[buildid]:
-            if buildid not in new_data:
-                new_data[buildid] = []
-            region_id = region['region_id']
-            image_id = region['image_id']
-            tag_image(region_id, image_id, tag_key, tag_value)
-            new_data[buildid].append({ "region": region_id, "image": image_id, "deleted": False})
-
-    if os.path.exists(file_path):
-        logging.debug(f'Found existing {file_path}; updating with new data')
-        with open(file_path, 'r+') as f:
-            data = json.load(f)
-            data.update(new_data)
-            f.seek(0)
-            f.write(json.dumps(data))
-    else:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_ALIYUN_CONCURRENCY) as executor:
+        futures = [executor.submit(tag_one, buildid, region['region_id'], region['image_id'])
+                   for buildid in image_list for region in image_list[buildid]]
+        for future in concurrent.futures.as_completed(futures):
+            buildid, region_id, image_id = future.result()
+            new_data.setdefault(buildid, []).append({ "region": region_id, "image": image_id, "deleted": False})
+
+    try:
+        with open(file_path, 'r') as f:
+            logging.debug(f'Found existing {file_path}; updating with new data')
+            data = json_loads(f.read())
+        data.update(new_data)
+    except FileNotFoundError:
         logging.debug(f"Creating new {file_path} with tag data")
-        with open(file_path, 'w') as f:
-            f.write(json.dumps(new_data))
+        data = new_data
+    write_state_file(file_path, data)
 
     return
 
 
 # Utility function to get info about an image
 #
-# Takes region_id str and image_id str as arguments
+# Takes region_id str and image_id str as arguments; image_id may also be a
+# JSON array str of up to 100 image IDs to describe in one call. Callers
+# issuing many requests against one region can pass a prebuilt request object
+# via describe_req so it isn't reconstructed (and revalidated) per call
 #
 # Returns a JSON doc of the response from the API
-def get_image_info(region_id, image_id):
+def get_image_info(region_id, image_id, describe_req=None):
     client = create_client(region_id)
-    describe_req = DescribeImagesRequest()
+    if describe_req is None:
+        describe_req = DescribeImagesRequest()
+        describe_req.set_protocol_type('https')
+        # DescribeImages pages at 10 results by default; batched callers
+        # would otherwise only get the first 10 of their chunk back
+        describe_req.set_PageSize(100)
     describe_req.set_ImageId(image_id)
-    describe_req.set_protocol_type('https')
 
-    logging.debug(f"Sending DescribeImages request for {image_id}")
+    logging.debug("Sending DescribeImages request for %s", image_id)
 
     try:
         describe_resp = client.do_action_with_exception(describe_req)
@@ -196,20 +365,24 @@ def get_image_info(region_id, image_id):
         logging.error("Unable to describe {}: {}".format(image_id, e))
         sys.exit(1)
 
-    return json.loads(describe_resp.decode("utf-8"))
+    return json_loads(describe_resp)
 
 
 # Utility function to mark an image public/private
 #
-# Takes region_id str, image_id str, public boolean
+# Takes region_id str, image_id str, public boolean; optionally a current
+# boolean if the caller already knows the image's IsPublic state, which skips
+# the extra DescribeImages round-trip
 #
 # Returns a JSON doc of the response from the API
-def change_visibility(region_id, image_id, public=False):
+def change_visibility(region_id, image_id, public=False, current=None):
     # changing IsPublic via ModifyImageSharePermissionRequest is not idempotent,
     # so we have to check to see if the value is already set properly
-    image_info = get_image_info(region_id, image_id)
-    if image_info['Images']['Image'][0]['IsPublic'] == public:
-        logging.debug(f"{image_id} is already marked IsPublic={public}")
+    if current is None:
+        image_info = get_image_info(region_id, image_id)
+        current = image_info['Images']['Image'][0]['IsPublic']
+    if current == public:
+        logging.debug("%s is already marked IsPublic=%s", image_id, public)
         # return empty JSON doc
         return json.dumps("{}")
 
@@ -219,11 +392,11 @@ def change_visibility(region_id, image_id, public=False):
     modify_req.set_IsPublic(public)
     modify_req.set_protocol_type('https')
 
-    logging.debug(f"Marking {image_id} in {region_id} with IsPublic={public}")
+    logging.debug("Marking %s in %s with IsPublic=%s", image_id, region_id, public)
     modify_resp = run_cmd([client, modify_req])
     if modify_resp == 'dry_run':
         return json.dumps('{}')
-    return json.loads(modify_resp.decode("utf-8"))
+    return json_loads(modify_resp)
 
 
 # Deletes an image from the cloud.
@@ -232,44 +405,81 @@ def change_visibility(region_id, image_id, public=False):
 #
 # Updates the JSON doc with results
 def delete_images(file_path):
-    if os.path.exists(file_path):
-        logging.debug(f"Found file {file_path}")
+    try:
         with open(file_path, 'r') as f:
-            deleted_images_json = json.load(f)
-    else:
+            logging.debug(f"Found file {file_path}")
+            deleted_images_json = json_loads(f.read())
+    except FileNotFoundError:
         logging.error(f"Unable to find {file_path}")
         sys.exit(1)
 
+    # one batched DescribeImages per region up front tells us which pending
+    # images are still public, instead of describing every image individually
+    # (and then a second time inside change_visibility)
+    # keyed on image id so images recorded under more than one build are only
+    # described once
+    pending = {}
+    for buildid in deleted_images_json:
+        for item in deleted_images_json[buildid]:
+            if not item["deleted"]:
+                pending.setdefault(item['region'], {})[item['image']] = None
+
+    is_public = {}
+    for region_id in pending:
+        imageids = list(pending[region_id])
+        for start in range(0, len(imageids), 100):
+            chunk = imageids[start:start + 100]
+            logging.debug("Getting image info for %d images in %s", len(chunk), region_id)
+            response = get_image_info(region_id, json.dumps(chunk))
+            for image in response['Images']['Image']:
+                is_public[(region_id, image['ImageId'])] = image['IsPublic']
+
+    # each pending image takes up to two sequential API calls (modify, then
+    # delete), so walking them serially just stacks latency; collect the
+    # pending entries and fan them out over the thread pool. Each worker
+    # mutates only its own entry dict, so the results land in
+    # deleted_images_json without any merging
+    def delete_image(item):
+        region_id = item['region']
+        image_id = item['image']
+        # we have to mark the image private before deleting it
+        if is_public.get((region_id, image_id)) is True:
+            change_visibility(region_id, image_id, public=False, current=True)
+
+        client = create_client(region_id)
+        delete_req = DeleteImageRequest()
+        delete_req.set_ImageId(image_id)
+        delete_req.set_protocol_type('https')
+
+        logging.warning(f"---Deleting {image_id} in {region_id}")
+        delete_resp = run_cmd([client, delete_req])
+        if delete_resp == 'dry_run':
+            return
+        item["deleted"] = True
+
+    tasks = []
     for buildid in deleted_images_json:
         logging.info(f"Working through images/regions for {buildid} to delete...")
-        # enumerate the list of regions/images
-        for pos, item in enumerate(deleted_images_json[buildid]):
-            region_id = item['region']
-            image_id = item['image']
-            # if the image hasn't been marked deleted, remove it, and then update
-            # the 'deleted' key to True
+        for item in deleted_images_json[buildid]:
             if not item["deleted"]:
-                # we have to mark the image private before deleting it
-                image_info = get_image_info(region_id, image_id)
-                if image_info['Images']['Image'][0]['IsPublic'] is True:
-                    change_visibility(region_id, image_id, public=False)
-
-                client = create_client(region_id)
-                delete_req = DeleteImageRequest()
-                delete_req.set_ImageId(image_id)
-                delete_req.set_protocol_type('https')
-
-                logging.warning(f"---Deleting {image_id} in {region_id}")
-                delete_req = run_cmd([client, delete_req])
-                if delete_req  == 'dry_run':
-                    continue
-                deleted_images_json[buildid][pos]["deleted"] = True
+                tasks.append(item)
             else:
-                logging.debug(f"{image_id} in {region_id} already marked as deleted")
+                logging.debug("%s in %s already marked as deleted", item['image'], item['region'])
 
-    # after iterating through all the build ids, write out the new data
-    with open(file_path, 'w') as f:
-        json.dump(deleted_images_json, f)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_ALIYUN_CONCURRENCY) as executor:
+        futures = [executor.submit(delete_image, item) for item in tasks]
+        completed = 0
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            completed += 1
+            # flush progress every so often so a crash doesn't lose every
+            # deletion made up to that point; the workers only flip the
+            # pre-existing 'deleted' values, so snapshotting here is safe
+            if completed % 10 == 0:
+                write_state_file(file_path, deleted_images_json)
+
+    # after working through all the images, write out the final data
+    write_state_file(file_path, deleted_images_json)
 
 
 # Run the commands passed in dry mode or execute them, defaults to 'dru_run=True'
@@ -283,67 +493,142 @@ def run_cmd(command, silent = False, ignore_error = False):
     params = command[1]._params
     request = command[1]
     client = command[0]
-    try:
-        if DRY_RUN:
-            print("Running --- Dry Run ----")
-            print("Action to perfom:%s" % (action))
-            print("Parameters:%s" % (params))
-            return 'dry_run'
-        else:
+    if DRY_RUN:
+        # a single log record instead of three print() calls keeps parallel
+        # workers from interleaving their dry-run output on stdout
+        logging.info("Dry run --- would perform action:%s with parameters:%s", action, params)
+        return 'dry_run'
+    for attempt in range(MAX_API_RETRIES):
+        try:
             result = client.do_action_with_exception(request)
             return result
-    except (ClientException, ServerException) as e:
-        if not ignore_error:
-            logging.error("Unable to perfom action:{} with: {}. {}".format(action, params, e))
-            sys.exit(1)
-        return False
+        except (ClientException, ServerException) as e:
+            # throttles and transient server-side errors clear up on their
+            # own, so back off and retry those with a little jitter to keep
+            # parallel workers from retrying in lockstep; anything else
+            # (auth, bad params) won't get better by asking again
+            if str(e.get_error_code()).startswith(RETRYABLE_ERROR_CODES) and \
+              attempt < MAX_API_RETRIES - 1:
+                delay = random.uniform(0, min(10, 0.5 * 2 ** attempt))
+                logging.warning(f"Retryable error from {action} ({e.get_error_code()}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            if not ignore_error:
+                logging.error("Unable to perfom action:{} with: {}. {}".format(action, params, e))
+                sys.exit(1)
+            return False
 
 
 # Finds the Aliyun images included in a bootimage bump to openshift/installer
 # given an OCP version string
 #
-# Takes a release version (i.e. 4.10) as an argument
+# Takes a release version (i.e. 4.10) as an argument; optionally a depth int
+# to only look at the last N commits of the branch instead of its full history
 #
 # Returns a dict keyed off of build ID with values like {region_id: {release: build_id, image: image_id}}
-def parse_openshift_installer(release):
-    tmpdir = tempfile.mkdtemp()
+def parse_openshift_installer(release, depth=None):
     rhcos_json_path = 'data/data/coreos/rhcos.json'
-    full_rhcos_json_path = os.path.join(tmpdir, rhcos_json_path)
     full_release = "release-" + release
 
-    logging.debug("Cloning repo")
-    repo = git.Repo.clone_from(OPENSHIFT_INSTALL_GIT, tmpdir)
-    logging.debug(f"Checking out branch {full_release}")
-    repo.git.checkout(full_release)
+    # the parsed results only change when the release branch moves, so cache
+    # them on disk keyed off the branch tip sha; a single ls-remote round-trip
+    # is enough to know whether the clone+scan can be skipped entirely. A
+    # depth-limited scan only sees part of the history, so don't cache it
+    cache_path = None
+    if depth is None:
+        tip = git.cmd.Git().ls_remote(OPENSHIFT_INSTALL_GIT, "refs/heads/" + full_release).split()[0]
+        cache_path = os.path.join(CACHE_DIR, f"installer-{release}-{tip}.json")
+        try:
+            with open(cache_path, 'r') as f:
+                logging.debug(f"Using cached installer data from {cache_path}")
+                return json_loads(f.read())
+        except FileNotFoundError:
+            pass
+
+    tmpdir = tempfile.mkdtemp()
+
+    # a full clone of openshift/installer is hundreds of MB but we only ever
+    # read rhcos.json, so do a partial (blob-less) clone of the release branch
+    # with no working tree at all; blobs are fetched lazily as the commit
+    # iteration touches them. With a depth limit, a plain shallow clone of
+    # the last N commits is smaller still
+    clone_options = ['--no-checkout', '--single-branch', '--branch', full_release]
+    if depth is not None:
+        clone_options += ['--depth', str(depth)]
+        logging.debug(f"Cloning repo (shallow clone of {full_release}, depth {depth})")
+    else:
+        clone_options += ['--filter=blob:none']
+        logging.debug(f"Cloning repo (partial clone of {full_release})")
+    repo = git.Repo.clone_from(OPENSHIFT_INSTALL_GIT, tmpdir,
+                               multi_options=clone_options)
+    # a single `git log --raw` lists every commit that touched rhcos.json
+    # together with the blob sha it pointed at afterwards, so we can read the
+    # blobs straight out of the object database without walking a tree (or
+    # spawning a git process) per commit. --first-parent keeps the walk on
+    # the release branch itself instead of descending into every merged
+    # topic branch, which would mostly re-surface blobs we've already seen
     logging.debug("Getting commits")
-    rhcos_commits = repo.iter_commits(paths=rhcos_json_path)
+    rawlog = repo.git.log('--format=%H', '--no-abbrev', '--raw', '--first-parent', '--', rhcos_json_path)
 
     # dict keyed off build id
     aliyun_images = {}
-    for commit in rhcos_commits:
-        logging.debug(f"Checking {commit.hexsha} for Aliyun images")
-        repo.git.checkout(commit.hexsha)
-        with open(full_rhcos_json_path, 'r') as f:
-            rhcos_json = json.load(f)
+    # many commits touch rhcos.json without changing it (merges, etc), so the
+    # same blob shows up repeatedly; identical content always produces
+    # identical entries, so a blob we've already processed can be skipped
+    # outright rather than re-parsed and re-recorded
+    seen_blobs = set()
+    commit_sha = None
+    for line in rawlog.splitlines():
+        if not line:
+            continue
+        if not line.startswith(':'):
+            commit_sha = line
+            continue
+        # raw diff lines look like ':100644 100644 <old sha> <new sha> M\tpath'
+        blob_sha = line.split()[3]
+        if blob_sha == '0' * 40:
+            # the file was deleted in this commit
+            continue
+        if blob_sha in seen_blobs:
+            continue
+        seen_blobs.add(blob_sha)
+        logging.debug("Checking %s for Aliyun images", commit_sha)
+        rhcos_json = json_loads(repo.odb.stream(bytes.fromhex(blob_sha)).read())
 
         if 'aliyun' in rhcos_json['architectures']['x86_64']['images']:
             build_id = rhcos_json['architectures']['x86_64']['artifacts']['aliyun']['release']
-            logging.debug(f"Recording {build_id} as having Aliyun images")
+            logging.debug("Recording %s as having Aliyun images", build_id)
             aliyun_images[build_id] = rhcos_json['architectures']['x86_64']['images']['aliyun']['regions']
 
     shutil.rmtree(tmpdir)
+
+    if cache_path is not None:
+        logging.debug(f"Caching installer data to {cache_path}")
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # write to a temp file and rename so a crash can't leave a
+        # half-written cache entry behind
+        with open(cache_path + '.tmp', 'w') as f:
+            f.write(json_dumps(aliyun_images))
+        os.replace(cache_path + '.tmp', cache_path)
+
     return aliyun_images
 
 
 def main():
+    global MAX_ALIYUN_CONCURRENCY
+
     parser = argparse.ArgumentParser()
     parser.add_argument('release', help="OCP release to operate on")
     parser.add_argument('--dry-run', help="Just print what would happen", action='store_true')
     parser.add_argument('--debug', '-d', help="Enable debug logging", action='store_true')
     parser.add_argument('--filename', help="Path to file where bootimage data can be recorded; will allow for faster execution if script is run multiple times")
     parser.add_argument('--log-to-file', help="Filename to record all log output to")
+    parser.add_argument('--history-depth', type=int, help="Only inspect the last N commits of openshift/installer for bootimage bumps; faster, but may miss bumps older than that")
+    parser.add_argument('--concurrency', type=int, default=MAX_ALIYUN_CONCURRENCY, help="How many Aliyun API calls to have in flight at once")
     args = parser.parse_args()
 
+    MAX_ALIYUN_CONCURRENCY = args.concurrency
+
     deleted_images_filename = "deleted_images.json"
     if args.filename is not None:
         deleted_images_filename = args.filename
@@ -376,53 +661,71 @@ def main():
     deleted_images_json = {}
 
     global DRY_RUN
-    DRY_RUN = False
-    if args.dry_run:
-        DRY_RUN = True
+    DRY_RUN = args.dry_run
 
     # preload images that should be deleted
-    if os.path.exists(deleted_images_filename):
-        logging.debug(f"Found file: {deleted_images_filename}")
+    try:
         with open(deleted_images_filename, 'r') as f:
-            deleted_images_json = json.load(f)
+            logging.debug(f"Found file: {deleted_images_filename}")
+            deleted_images_json = json_loads(f.read())
+    except FileNotFoundError:
+        pass
 
     # # get aliyun images in the installer
     logging.info("Parsing the installer code")
-    bootimages = parse_openshift_installer(args.release)
-    logging.info("Getting untagged images from installer data")
-    bootimages = get_images_not_tagged(bootimages)
+    bootimages = parse_openshift_installer(args.release, depth=args.history_depth)
 
     # get builds with aliyun uploads from a builds.json
     logging.info("Finding builds with Aliyun uploads from builds.json")
     aliyun_releases = parse_release(args.release, deleted_images_json)
+
+    # the installer data and the builds.json data overlap heavily (both come
+    # from the same release), so merge them and find the untagged images with
+    # a single pass instead of describing the overlapping images twice; all
+    # we need from the installer side afterwards is which builds it shipped
+    installer_builds = set(bootimages)
+    merged = {}
+    for source in (bootimages, aliyun_releases):
+        for buildid in source:
+            merged.setdefault(buildid, {}).update(source[buildid])
+
     logging.info("Finding untagged images in all Aliyun uploads")
-    aliyun_releases = get_images_not_tagged(aliyun_releases)
+    untagged = get_images_not_tagged(merged)
+
+    # only the builds from builds.json are tag/delete candidates below
+    aliyun_releases = {buildid: untagged[buildid] for buildid in aliyun_releases}
 
     if len(aliyun_releases) == 0:
         logging.error("Didn't find any images to tag or delete")
         sys.exit(1)
 
     # find the builds from builds.json that are not in bootimages and generate
-    # a dict to operate on later
+    # a dict to operate on later; the bootimage=true tags are independent API
+    # calls, so collect them all first and fan out over a thread pool
+    tag_true = []
     for buildid in aliyun_releases:
         logging.info(f"Checking if {buildid} was used in openshift/installer")
-        if buildid not in image_list:
-            image_list[buildid] = []
+        image_list.setdefault(buildid, [])
 
         if buildid in deleted_images_json:
-            logging.debug(f"Found {buildid} in {deleted_images_filename}; skipping tagging")
+            logging.debug("Found %s in %s; skipping tagging", buildid, deleted_images_filename)
             continue
 
-        if buildid in bootimages:
-            logging.debug(f"Found {buildid} in openshift/installer, tagging images with bootimage=true")
-            for region in aliyun_releases[buildid]:
-                image_id =region['image_id']
-                region = region['region_id']
-                tag_image(region, image_id, tag_key="bootimage", tag_value="true")
+        if buildid in installer_builds:
+            logging.debug("Found %s in openshift/installer, tagging images with bootimage=true", buildid)
+            for item in aliyun_releases[buildid]:
+                tag_true.append((item['region_id'], item['image_id']))
         else:
-            # region here is a '{region_id: image_id}' dict
-            for region in aliyun_releases[buildid]:
-                image_list[buildid].append(region)
+            # item here is a '{region_id: image_id}' dict
+            for item in aliyun_releases[buildid]:
+                image_list[buildid].append(item)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_ALIYUN_CONCURRENCY) as executor:
+        futures = [executor.submit(tag_image, region_id, image_id,
+                                   tag_key="bootimage", tag_value="true")
+                   for region_id, image_id in tag_true]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
 
     # With a dict of buildids that have all the regions/imageids that are not
     # in the openshift/installer data, we can tag the images with bootimage=false